@@ -1,4 +1,14 @@
+import copy
+import os
+import pickle
+import tempfile
+
 import yaml
+try:
+    # libyaml-backed loader, several times faster than the python one
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
 
 
 DEFAULTS = {
@@ -174,16 +184,175 @@ DEFAULTS = {
     }
 }
 
-def _merge(src, dst):
-    for k, v in src.items():
-        if k in dst:
-            if isinstance(v, dict):
-                _merge(src[k], dst[k])
+def _collect_leaves(tree):
+    # flatten a nested dict into (path, key, value) triples, once
+    leaves = []
+    stack = [(tree, ())]
+    while stack:
+        node, path = stack.pop()
+        for k, v in node.items():
+            if isinstance(v, dict) and v:
+                stack.append((v, path + (k,)))
+            else:
+                leaves.append((path, k, v))
+    return leaves
+
+def _group_leaves(leaves):
+    groups = {}
+    for path, key, value in leaves:
+        groups.setdefault(path, []).append((key, value))
+    return list(groups.items())
+
+# DEFAULTS flattened and grouped by section at import time; applying
+# defaults to a parsed config is then one path descent per section and a
+# flat loop per leaf, instead of a nested dict walk. Matters mostly for
+# sweep drivers that call load_config many times.
+_DEFAULT_SECTIONS = _group_leaves(_collect_leaves(DEFAULTS))
+
+def _apply_section(data, key, leaves):
+    for rest, leaf_key, value in leaves:
+        node = data.setdefault(key, {})
+        for p in rest:
+            node = node.setdefault(p, {})
+        if leaf_key not in node:
+            # copy mutable defaults so configs never alias module state
+            if isinstance(value, (dict, list)):
+                value = copy.deepcopy(value)
+            node[leaf_key] = value
+
+
+class LazyConfig(dict):
+    '''
+    Config dict that fills a section's defaults on first access, so
+    sections a run never touches are never materialized. Iterating or
+    comparing the config realizes everything; pickling and repr work on
+    a realized copy and leave the laziness intact. Plain-dict semantics
+    are preserved for all existing callers.
+    '''
+
+    def __init__(self, data, pending):
+        super().__init__(data)
+        self._pending = dict(pending)
+
+    def _realize(self, key):
+        _apply_section(self, key, self._pending.pop(key))
+
+    def _realize_all(self):
+        for key in list(self._pending):
+            self._realize(key)
+
+    def _realized_copy(self):
+        # pending defaults applied into a copy; self stays lazy. The
+        # snapshot goes through the unbound base-class methods because
+        # dict(self) and dict.copy(self) both dispatch to the overridden
+        # keys() and would realize everything in place.
+        data = {k: dict.__getitem__(self, k) for k in dict.keys(self)}
+        data = copy.deepcopy(data)
+        for key, leaves in self._pending.items():
+            _apply_section(data, key, leaves)
+        return data
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            self._realize(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key in self._pending:
+            self._realize(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        if key in self._pending:
+            self._realize(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        if key in self._pending:
+            self._realize(key)
+        return super().pop(key, *args)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._pending
+
+    def __len__(self):
+        self._realize_all()
+        return super().__len__()
+
+    def __iter__(self):
+        self._realize_all()
+        return super().__iter__()
+
+    def keys(self):
+        self._realize_all()
+        return super().keys()
+
+    def values(self):
+        self._realize_all()
+        return super().values()
+
+    def items(self):
+        self._realize_all()
+        return super().items()
+
+    def copy(self):
+        return self._realized_copy()
+
+    def __eq__(self, other):
+        self._realize_all()
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._realized_copy())
+
+    def __reduce__(self):
+        # pickle a realized plain dict, without collapsing the live
+        # object: the cache write right after parsing must not realize
+        # the config it is about to hand back to the caller
+        return (dict, (self._realized_copy(),))
+
+
+def _apply_defaults(config):
+    # top-level scalar defaults are filled eagerly (a handful of keys);
+    # per-section defaults are deferred until the section is accessed
+    pending = {}
+    for path, leaves in _DEFAULT_SECTIONS:
+        if not path:
+            for key, value in leaves:
+                if key not in config:
+                    if isinstance(value, (dict, list)):
+                        value = copy.deepcopy(value)
+                    config[key] = value
         else:
-            dst[k] = v
+            pending.setdefault(path[0], []).extend(
+                (path[1:], key, value) for key, value in leaves)
+    return LazyConfig(config, pending)
+
+def _validate_config(config):
+    # structural check against DEFAULTS: a yaml key that overlaps a known
+    # one must keep its shape (section vs value) so typos fail here with a
+    # clear message instead of deep inside training. Extra keys (dataset
+    # json/feat paths etc.) stay allowed, the config schema is open.
+    stack = [(config, DEFAULTS, "")]
+    while stack:
+        node, ref, prefix = stack.pop()
+        for k, v in node.items():
+            if k not in ref:
+                continue
+            if isinstance(ref[k], dict) and ref[k]:
+                if not isinstance(v, dict):
+                    raise ValueError(
+                        "{}{} should be a config section".format(prefix, k))
+                stack.append((v, ref[k], "{}{}.".format(prefix, k)))
+            elif isinstance(v, dict):
+                raise ValueError(
+                    "{}{} should be a value, not a section".format(prefix, k))
+    return config
 
 def load_default_config():
-    config = DEFAULTS
+    config = copy.deepcopy(DEFAULTS)
     return config
 
 def _update_config(config):
@@ -196,9 +365,50 @@ def _update_config(config):
     config["model"]["cl_cfg"] = config["cl_cfg"]
     return config
 
-def load_config(config_file, defaults=DEFAULTS):
-    with open(config_file, "r") as fd:
-        config = yaml.load(fd, Loader=yaml.FullLoader)
-    _merge(defaults, config)
-    config = _update_config(config)
+# merged configs cached per (path, mtime), so DDP workers that load the
+# same yaml several times in one process skip the parser entirely
+_CONFIG_CACHE = {}
+
+def _write_cache(config_file, cache_file, config):
+    # atomic write so concurrent workers never read a partial pickle
+    try:
+        cache_dir = os.path.dirname(cache_file) or "."
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".pkl")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        # drop caches stranded by earlier mtimes of the same yaml
+        prefix = os.path.basename(config_file) + "."
+        for name in os.listdir(cache_dir):
+            if (name.startswith(prefix) and name.endswith(".pkl")
+                    and name != os.path.basename(cache_file)):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+    except OSError:
+        # cache dir not writable; parsing again next time is fine
+        pass
+
+def load_config(config_file):
+    mtime = os.path.getmtime(config_file)
+    cache_key = (os.path.abspath(config_file), mtime)
+    if cache_key in _CONFIG_CACHE:
+        return _CONFIG_CACHE[cache_key]
+
+    # on-disk cache keyed by mtime: re-parse only when the yaml changed
+    cache_file = "{}.{}.pkl".format(config_file, mtime)
+    if os.path.isfile(cache_file):
+        with open(cache_file, "rb") as fd:
+            config = pickle.load(fd)
+    else:
+        with open(config_file, "r") as fd:
+            # hand the loader one buffer instead of a file object
+            config = yaml.load(fd.read(), Loader=_Loader)
+        config = _validate_config(config)
+        config = _apply_defaults(config)
+        config = _update_config(config)
+        _write_cache(config_file, cache_file, config)
+
+    _CONFIG_CACHE[cache_key] = config
     return config
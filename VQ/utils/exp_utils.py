@@ -129,12 +129,12 @@ def create_logger(cfg, cfg_name, phase='train'):
     return logger, str(final_output_dir), str(tb_log_dir)
 
 
-def dict_to_cuda(batch):
-    return {k: try_to_cuda(v) for k, v in batch.items()}
+def dict_to_cuda(batch, non_blocking=False):
+    return {k: try_to_cuda(v, non_blocking) for k, v in batch.items()}
 
-def try_to_cuda(t):
+def try_to_cuda(t, non_blocking=False):
     try:
-        t = t.cuda()
+        t = t.cuda(non_blocking=non_blocking)
     except AttributeError:
         pass
     return t
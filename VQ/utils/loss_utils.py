@@ -89,9 +89,10 @@ def get_losses_with_anchor(config, preds, gts):
         pred_prob_refine = pred_prob_refine.reshape(-1)
         weight = torch.tensor(config.loss.prob_bce_weight).to(gt_prob.device)
         weight_ = weight[gt_prob[gt_before_query.bool()].long()].reshape(-1)
-        criterion = nn.BCEWithLogitsLoss(reduce=False)
-        loss_prob_refine = (criterion(pred_prob_refine[gt_before_query.reshape(-1).bool()], 
-                                      gt_prob[gt_before_query.bool()]) * weight_).mean()
+        loss_prob_refine = (F.binary_cross_entropy_with_logits(
+                                pred_prob_refine[gt_before_query.reshape(-1).bool()],
+                                gt_prob[gt_before_query.bool()],
+                                reduction='none') * weight_).mean()
 
     loss = {
         'loss_bbox_center': loss_center,
@@ -152,9 +153,10 @@ def get_losses_head(config, refine_prob, gts, preds_top):
 
     weight = torch.tensor(config.loss.prob_bce_weight).to(gt_prob.device)
     weight_ = weight[gt_prob_refine[gt_before_query.bool()].long()]
-    criterion = nn.BCEWithLogitsLoss(reduce=False)
-    loss_prob_refine = (criterion(refine_prob[gt_before_query.reshape(-1).bool()], 
-                                  gt_prob_refine[gt_before_query.bool()]) * weight_).mean()
+    loss_prob_refine = (F.binary_cross_entropy_with_logits(
+                            refine_prob[gt_before_query.reshape(-1).bool()],
+                            gt_prob_refine[gt_before_query.bool()],
+                            reduction='none') * weight_).mean()
     loss = {
         'loss_refine_prob': loss_prob_refine,
         'weight_refine_prob': 1.0
@@ -191,8 +193,10 @@ def get_losses(config, preds, gts):
     # occurance loss
     weight = torch.tensor(config.loss.prob_bce_weight).to(gt_prob.device)
     weight_ = weight[gt_prob[gt_before_query.bool()].long()].reshape(-1)
-    criterion = nn.BCEWithLogitsLoss(reduce=False)
-    loss_prob = (criterion(pred_prob[gt_before_query.bool()], gt_prob[gt_before_query.bool()]) * weight_).mean()
+    loss_prob = (F.binary_cross_entropy_with_logits(
+                     pred_prob[gt_before_query.bool()],
+                     gt_prob[gt_before_query.bool()],
+                     reduction='none') * weight_).mean()
     #loss_prob = F.binary_cross_entropy(pred_prob, gt_prob)
     loss = {
         'loss_bbox_center': loss_center,